@@ -0,0 +1,78 @@
+import json
+import logging
+import os
+import os.path as path
+from multiprocessing import Pool
+from .decision_table import DecisionTable
+
+logger = logging.getLogger(__name__)
+
+
+def analyze_table_file(table_path: str, output_dir: str = None, version: str = '4') -> dict:
+    """
+    Run the DecisionTable analyses on a single decision table dump
+    :param table_path: path to the json file containing the dumped decision table
+    :param output_dir: folder where the modified decision table is written. If None, the modified table is not saved
+    :param version: StarChat version of the dumped decision table
+    :return: dict() with a compact summary of the analysis. On failure, the dict contains the `error` key
+    """
+    record = {'file': path.basename(table_path)}
+    try:
+        with open(table_path, encoding='utf-8') as f:
+            table = json.load(f)
+        dt = DecisionTable(table, version=version)
+        n_states = len(dt.states)
+        with_keywords = sum(dt.states_with_keywords())
+        with_queries = sum(dt.states_with_queries())
+        parents = dict()
+        for state_obj in dt.states:
+            state_parents = dt.get_parents(state_obj.state)
+            if state_parents:
+                parents[state_obj.state] = state_parents
+        record['states'] = n_states
+        record['states_with_keywords'] = with_keywords
+        record['states_with_queries'] = with_queries
+        record['keyword_coverage'] = with_keywords / n_states if n_states else 0.0
+        record['query_coverage'] = with_queries / n_states if n_states else 0.0
+        record['parents'] = parents
+        if output_dir is not None:
+            modified_table = dt.modified_decision_table()
+            out_path = path.join(output_dir, path.basename(table_path))
+            with open(out_path, 'w', encoding='utf-8') as f:
+                json.dump(modified_table, f, ensure_ascii=False)
+            record['modified_table'] = out_path
+            record['modified_states'] = modified_table['total']
+    except Exception as e:
+        logger.warning('Something went wrong analyzing decision table {}: {!r}'.format(table_path, e))
+        record['error'] = repr(e)
+    return record
+
+
+def _analyze_table_file(args):
+    return analyze_table_file(*args)
+
+
+def analyze_directory(folder: str,
+                      output_dir: str = None,
+                      version: str = '4',
+                      processes: int = None,
+                      max_tasks_per_child: int = 10):
+    """
+    Run the DecisionTable analyses on all the json decision table dumps in a folder, using a process pool.
+    Records are yielded as soon as each table is analyzed, so the order does not follow the folder listing.
+    :param folder: folder containing the dumped decision tables (one json file per index)
+    :param output_dir: folder where the modified decision tables are written. If None, they are not saved
+    :param version: StarChat version of the dumped decision tables
+    :param processes: number of worker processes. If None, all available cores are used
+    :param max_tasks_per_child: number of tables analyzed by a worker before it is replaced by a fresh process,
+                                in order to keep memory per worker bounded
+    :return: generator of dict() records as returned by `analyze_table_file`
+    """
+    files = sorted(f for f in os.listdir(folder) if f.endswith('.json'))
+    logger.info('Analyzing {} decision tables in {}'.format(len(files), folder))
+    if output_dir is not None:
+        os.makedirs(output_dir, exist_ok=True)
+    tasks = [(path.join(folder, f), output_dir, version) for f in files]
+    with Pool(processes=processes, maxtasksperchild=max_tasks_per_child) as pool:
+        for record in pool.imap_unordered(_analyze_table_file, tasks):
+            yield record
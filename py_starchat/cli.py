@@ -0,0 +1,273 @@
+"""
+Command line interface for bulk operations on StarChat, installed as the `py-starchat` console script.
+Heavy modules (requests, numpy, the client itself) are imported only by the subcommands that need them.
+"""
+import argparse
+import contextlib
+import json
+import os
+import sys
+import threading
+from .utilities import ordered_map
+
+
+def _client(args):
+    from .starchat_client import StarChatClient
+    client = StarChatClient(url=args.url, port=args.port, version=args.starchat_version,
+                            max_connections=max(10, getattr(args, 'workers', 1)))
+    if args.user:
+        client.authenticate(args.user, args.password)
+    return client
+
+
+@contextlib.contextmanager
+def _no_close(stream):
+    # same as contextlib.nullcontext, which is not available in python 3.6
+    yield stream
+
+
+def _open_input(file_path: str):
+    return _no_close(sys.stdin) if file_path == '-' else open(file_path, encoding='utf-8')
+
+
+def _open_output(file_path: str):
+    return _no_close(sys.stdout) if file_path == '-' else open(file_path, 'w', encoding='utf-8')
+
+
+def _write_jsonl(records, output) -> int:
+    n = 0
+    for rec in records:
+        output.write(json.dumps(rec, ensure_ascii=False) + '\n')
+        n += 1
+    output.flush()
+    return n
+
+
+def _lines(stream):
+    for line in stream:
+        line = line.rstrip('\n')
+        if line.strip():
+            yield line
+
+
+def load_table(args) -> int:
+    client = _client(args)
+    out = client.load_decision_table_file(args.index_name, args.file)
+    if client.version_major == '4':
+        ok = all(out.values())
+        print(json.dumps({'states': len(out), 'failed': [state for state, check in out.items() if not check]}))
+    else:
+        ok = out.status_code == 200
+        print(json.dumps({'status_code': out.status_code}))
+    if ok and args.wait:
+        with open(args.file, encoding='utf-8') as f:
+            expected = len(json.load(f)['hits'])
+        ok = client.wait_for_states_count(args.index_name, expected=expected, timeout=args.timeout) is not None
+    return 0 if ok else 1
+
+
+def dump_table(args) -> int:
+    client = _client(args)
+    if args.cache:
+        from .dump_cache import DumpCache
+        table = DumpCache(args.cache, max_age=args.max_age).get(client, args.index_name)
+    else:
+        table = client.decision_table_dump(args.index_name)
+    with _open_output(args.output) as output:
+        json.dump(table, output, ensure_ascii=False)
+    return 0
+
+
+def load_terms(args) -> int:
+    client = _client(args)
+    validator = None
+    quarantine_lock = threading.Lock()
+    if args.validate or args.quarantine:
+        from .validation import TermValidator
+        validator = TermValidator(vector_dim=args.vector_dim)
+        if args.validate and not args.quarantine and args.file != '-':
+            # validate the whole file before sending anything to StarChat
+            n_invalid = _count_invalid_terms(args, validator)
+            if n_invalid:
+                print(json.dumps({'terms': 0, 'invalid': n_invalid}))
+                return 1
+    with contextlib.ExitStack() as stack:
+        quarantine = None
+        if args.quarantine:
+            quarantine = stack.enter_context(open(args.quarantine, 'w', encoding='utf-8'))
+        n_terms, errors = _load_terms(args, client, validator, quarantine, quarantine_lock)
+    for error in errors:
+        sys.stderr.write('add_term: {}\n'.format(error))
+    print(json.dumps({'terms': n_terms, 'errors': len(errors)}))
+    return 1 if errors else 0
+
+
+def _read_term_batches(args, stream):
+    from .provisioning import read_terms
+    from .utilities import batches
+    if args.file.endswith('.json'):
+        return batches(read_terms(args.file), args.batch_size)
+    return batches((json.loads(line) for line in _lines(stream)), args.batch_size)
+
+
+def _count_invalid_terms(args, validator) -> int:
+    n_invalid = 0
+    with _open_input(args.file) as stream:
+        for batch in _read_term_batches(args, stream):
+            _, invalid = validator.validate_batch(batch)
+            for _, term, errors in invalid:
+                sys.stderr.write('invalid term {!r}: {}\n'.format(term.get('term') if isinstance(term, dict)
+                                                                  else term, errors))
+            n_invalid += len(invalid)
+    return n_invalid
+
+
+def _load_terms(args, client, validator, quarantine, quarantine_lock):
+    from .provisioning import add_term_batch
+
+    def add_terms(batch):
+        if validator is not None:
+            batch, invalid = validator.validate_batch(batch)
+            if invalid and quarantine is None:
+                raise ValueError('{} invalid terms, e.g. {!r}: {}'.format(len(invalid), invalid[0][1],
+                                                                          invalid[0][2]))
+            with quarantine_lock:
+                for _, term, errors in invalid:
+                    quarantine.write(json.dumps({'term': term, 'errors': errors}, ensure_ascii=False) + '\n')
+        if not batch:
+            return 0, None
+        try:
+            accepted, rejected = add_term_batch(client, args.index_name, batch)
+        except Exception as e:
+            return 0, repr(e)
+        if rejected:
+            return accepted, '{} terms rejected, e.g. {!r}'.format(len(rejected), rejected[0])
+        return accepted, None
+
+    n_terms = 0
+    errors = []
+    with _open_input(args.file) as stream:
+        for accepted, error in ordered_map(add_terms, _read_term_batches(args, stream), args.workers):
+            n_terms += accepted
+            if error is not None:
+                errors.append(error)
+    return n_terms, errors
+
+
+def tokenize_file(args) -> int:
+    client = _client(args)
+    with contextlib.ExitStack() as stack:
+        cache = None
+        if args.cache:
+            from .token_cache import TokenCache
+            cache = stack.enter_context(TokenCache(args.cache))
+
+        def tokenize(text):
+            return {'text': text,
+                    'tokens': client.tokenize(args.index_name, text, tokenizer=args.tokenizer, cache=cache)}
+
+        stream = stack.enter_context(_open_input(args.input))
+        output = stack.enter_context(_open_output(args.output))
+        _write_jsonl(ordered_map(tokenize, _lines(stream), args.workers), output)
+    return 0
+
+
+def replay(args) -> int:
+    from .shadow import _timed_response
+    client = _client(args)
+
+    def get_response(numbered_line):
+        n, line = numbered_line
+        if line.lstrip().startswith('{'):
+            el = json.loads(line)
+            text, conversation_id = el['text'], el.get('conversation_id', 'replay_{}'.format(n))
+        else:
+            text, conversation_id = line, 'replay_{}'.format(n)
+        out = _timed_response(client, args.index_name, text, conversation_id, args.threshold)
+        out['text'] = text
+        return out
+
+    with _open_input(args.input) as stream, _open_output(args.output) as output:
+        _write_jsonl(ordered_map(get_response, enumerate(_lines(stream)), args.workers), output)
+    return 0
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(prog='py-starchat', description='Bulk operations on StarChat')
+    parser.add_argument('--url', default=os.environ.get('STARCHAT_URL', 'http://localhost'))
+    parser.add_argument('--port', default=os.environ.get('STARCHAT_PORT', '8888'))
+    parser.add_argument('--starchat-version', default=os.environ.get('STARCHAT_VERSION', '5.1'),
+                        choices=['4.1', '4.2', '5.1'])
+    parser.add_argument('--user', default=os.environ.get('STARCHAT_USER'))
+    parser.add_argument('--password', default=os.environ.get('STARCHAT_PASSWORD'))
+    parser.add_argument('--trace', metavar='FILE', help='export a Chrome trace-event file of the run')
+    subparsers = parser.add_subparsers(dest='command')
+    subparsers.required = True
+
+    sub = subparsers.add_parser('load-table', help='load a decision table json file into an index')
+    sub.add_argument('index_name')
+    sub.add_argument('file')
+    sub.add_argument('--wait', action='store_true', help='wait until all the states are available')
+    sub.add_argument('--timeout', type=float, default=300)
+    sub.set_defaults(func=load_table)
+
+    sub = subparsers.add_parser('dump-table', help='dump the decision table of an index')
+    sub.add_argument('index_name')
+    sub.add_argument('-o', '--output', default='-')
+    sub.add_argument('--cache', metavar='DIR', help='use a local dump cache (see py_starchat.dump_cache)')
+    sub.add_argument('--max-age', type=float, default=3600,
+                     help='maximum age in seconds of a cached dump (default: %(default)s)')
+    sub.set_defaults(func=dump_table)
+
+    sub = subparsers.add_parser('load-terms', help='index terms from a json or jsonl file (or jsonl from stdin)')
+    sub.add_argument('index_name')
+    sub.add_argument('file', nargs='?', default='-')
+    sub.add_argument('--batch-size', type=int, default=1000)
+    sub.add_argument('--workers', type=int, default=4)
+    sub.add_argument('--validate', action='store_true',
+                     help='validate the whole file before sending any term (when reading from stdin, batches are '
+                          'validated as they are read, so terms of earlier batches may already be uploaded)')
+    sub.add_argument('--vector-dim', type=int, help='expected dimension of the term vectors, '
+                                                     'required with --validate and --quarantine')
+    sub.add_argument('--quarantine', metavar='FILE',
+                     help='validate the terms and write invalid ones to FILE instead of failing')
+    sub.set_defaults(func=load_terms)
+
+    sub = subparsers.add_parser('tokenize-file', help='tokenize each line of a text file, writing jsonl')
+    sub.add_argument('index_name')
+    sub.add_argument('input', nargs='?', default='-')
+    sub.add_argument('-o', '--output', default='-')
+    sub.add_argument('--tokenizer', default='base')
+    sub.add_argument('--cache', metavar='FILE', help='use a persistent tokenization cache')
+    sub.add_argument('--workers', type=int, default=4)
+    sub.set_defaults(func=tokenize_file)
+
+    sub = subparsers.add_parser('replay', help='send each input line to get_next_response, writing jsonl')
+    sub.add_argument('index_name')
+    sub.add_argument('input', nargs='?', default='-',
+                     help='one text per line, or jsonl with `text` and optional `conversation_id`')
+    sub.add_argument('-o', '--output', default='-')
+    sub.add_argument('--threshold', type=float, default=0.01)
+    sub.add_argument('--workers', type=int, default=4)
+    sub.set_defaults(func=replay)
+    return parser
+
+
+def main(argv=None) -> int:
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    if getattr(args, 'func', None) is load_terms and (args.validate or args.quarantine) and args.vector_dim is None:
+        parser.error('--vector-dim is required with --validate and --quarantine')
+    if args.trace:
+        from .tracing import enable_tracing
+        enable_tracing()
+    try:
+        return args.func(args)
+    finally:
+        if args.trace:
+            from .tracing import export_trace
+            export_trace(args.trace)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
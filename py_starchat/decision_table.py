@@ -1,9 +1,13 @@
 import copy
 import logging
+import re
 from .utilities import get_major_version
+from .tracing import traced
 
 logger = logging.getLogger(__name__)
 
+KEYWORD_PATTERN = re.compile(r'keyword\("([^"]*)"\)')
+
 
 def change_dict(my_dict: dict, to_replace: dict) -> None:
     """
@@ -126,6 +130,20 @@ class StarChatState:
         else:
             return False
 
+    def get_keywords(self) -> list:
+        """
+        Get the keywords used in the analyzer expression
+        :return: list of the (lowercase) keyword("...") literals, without duplicates, in order of appearance
+        """
+        if not isinstance(self.analyzer, str):
+            return []
+        keywords = []
+        for keyword in KEYWORD_PATTERN.findall(self.analyzer):
+            keyword = keyword.lower()
+            if keyword not in keywords:
+                keywords.append(keyword)
+        return keywords
+
     def has_queries(self) -> bool:
         """
         Check if a the state has whisperer's queries
@@ -140,6 +158,7 @@ class StarChatState:
 class DecisionTable:
     """Class to extract informations from and about a StarChat decision table"""
 
+    @traced
     def __init__(self, json_table: dict, version='4.2'):
         self.dec_table = json_table
         try:
@@ -151,6 +170,7 @@ class DecisionTable:
         self.states = [StarChatState(starchat_version=self.version) for _ in json_table['hits']]
         for hit, state_obj in zip(json_table['hits'], self.states):
             state_obj.set_all(hit['document'])
+        self._keyword_index = None
 
     def get_state(self, state_name):
         """
@@ -162,6 +182,7 @@ class DecisionTable:
                 return state_obj
         return None
 
+    @traced
     def get_parents(self, my_state):
         """
         Get the states from which my_state can be accessed
@@ -206,6 +227,55 @@ class DecisionTable:
         """
         return [state_obj.has_queries() for state_obj in self.states]
 
+    def keyword_index(self):
+        """
+        Get the inverted index of the analyzer keywords. The index is built once, the first time it is needed
+        :return: dict() containing keyword: list_of_state_names pairs
+        """
+        if self._keyword_index is None:
+            index = dict()
+            for state_obj in self.states:
+                for keyword in state_obj.get_keywords():
+                    index.setdefault(keyword, []).append(state_obj.state)
+            self._keyword_index = index
+        return self._keyword_index
+
+    def keyword_frequencies(self):
+        """
+        Get the number of states using each keyword in their analyzer
+        :return: dict() containing keyword: number_of_states pairs
+        """
+        return {keyword: len(states) for keyword, states in self.keyword_index().items()}
+
+    def keyword_overlaps(self):
+        """
+        Get the keywords shared between states, i.e. keywords that may make more than one state fire
+        :return: dict() containing (state_name_1, state_name_2): list_of_shared_keywords pairs
+        """
+        overlaps = dict()
+        for keyword, states in self.keyword_index().items():
+            for i, state_1 in enumerate(states):
+                for state_2 in states[i + 1:]:
+                    overlaps.setdefault((state_1, state_2), []).append(keyword)
+        return overlaps
+
+    def candidate_states(self, tokens: list):
+        """
+        Get the states whose analyzer contains at least one of the given tokens as keyword
+        :param tokens: list of tokens, either strings or token objects as returned by StarChatClient.tokenize
+        :return: dict() containing state_name: list_of_matched_keywords pairs
+        """
+        index = self.keyword_index()
+        candidates = dict()
+        for token in tokens:
+            if isinstance(token, dict):
+                token = token['token']
+            for state in index.get(token.lower(), []):
+                matched = candidates.setdefault(state, [])
+                if token.lower() not in matched:
+                    matched.append(token.lower())
+        return candidates
+
     def modified_analyzer(self, state):
         """
         Give the expression of the analyzer for the given state after removing the max(serach()) part and keeping
@@ -229,6 +299,7 @@ class DecisionTable:
             )
             return state_obj.analyzer
 
+    @traced
     def modified_decision_table(self):
         """
         Give the expression of the modified decision table, where:
@@ -256,6 +327,7 @@ class DecisionTable:
             modified_dec_table['max_score'] = self.dec_table['max_score']
         return modified_dec_table
 
+    @traced
     def to_version(self, out_version: str):
         """
         Convert decision table in order to be compatible with a different StarChat version
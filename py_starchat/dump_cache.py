@@ -0,0 +1,112 @@
+import gzip
+import hashlib
+import json
+import logging
+import os
+import os.path as path
+import time
+from .decision_table import DecisionTable
+
+logger = logging.getLogger(__name__)
+
+
+class DumpCache:
+    """
+    Local on-disk cache of decision table dumps, stored as gzip-compressed json files (one per StarChat index).
+    A cached dump is used as long as the number of entries in the index does not change and the dump is not
+    older than `max_age`: only the (cheap) entry count is asked to StarChat in this case.
+    StarChat does not expose modification timestamps for decision tables, so edits that do not change the number
+    of states (e.g. a modified analyzer, bubble or query) are not detected until the cached dump expires.
+    """
+
+    def __init__(self, cache_dir: str, max_age: float = 3600):
+        """
+        :param cache_dir: folder where dumps are stored (created if missing)
+        :param max_age: maximum age in seconds of a cached dump. If None, cached dumps never expire and are
+                        refreshed only when the number of entries in the index changes
+        """
+        self.cache_dir = cache_dir
+        self.max_age = max_age
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def _base_path(self, address: str, index_name: str) -> str:
+        server = hashlib.sha1(address.encode('utf-8')).hexdigest()[:12]
+        return path.join(self.cache_dir, '{}_{}'.format(server, index_name))
+
+    def _read_meta(self, base_path: str):
+        try:
+            with open(base_path + '.meta.json', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _is_valid(self, meta: dict, client, entries) -> bool:
+        if meta is None or entries is None:
+            return False
+        if meta['starchat_version'] != client.version or meta['entries'] != entries:
+            return False
+        if self.max_age is not None and time.time() - meta['fetched_at'] > self.max_age:
+            return False
+        return True
+
+    def get(self, client, index_name: str) -> dict:
+        """
+        Get the decision table of an index, downloading it from StarChat only if the cached dump is not valid
+        :param client: StarChatClient object
+        :param index_name: name of the index
+        :return: dict containing the decision table
+        """
+        base_path = self._base_path(client.address, index_name)
+        meta = self._read_meta(base_path)
+        # single request without retries: if StarChat does not answer promptly the dump is downloaded anyway
+        entries = client.states_count(index_name, trials=0)
+        if self._is_valid(meta, client, entries):
+            try:
+                with gzip.open(base_path + '.json.gz', 'rt', encoding='utf-8') as f:
+                    table = json.load(f)
+                logger.info('Using cached decision table for index "{}" ({} entries)'.format(index_name, entries))
+                return table
+            except (OSError, ValueError):
+                logger.warning('Cached decision table for index "{}" is corrupted'.format(index_name))
+        table = client.decision_table_dump(index_name)
+        data = json.dumps(table, separators=(',', ':'), ensure_ascii=False).encode('utf-8')
+        content_hash = hashlib.sha256(data).hexdigest()
+        if meta is not None and meta['sha256'] == content_hash and path.isfile(base_path + '.json.gz'):
+            logger.info('Decision table for index "{}" did not change'.format(index_name))
+        else:
+            tmp_path = base_path + '.json.gz.tmp'
+            with gzip.open(tmp_path, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_path, base_path + '.json.gz')
+        meta = {
+            'index_name': index_name,
+            'address': client.address,
+            'starchat_version': client.version,
+            'entries': entries if entries is not None else len(table['hits']),
+            'sha256': content_hash,
+            'fetched_at': time.time()
+        }
+        with open(base_path + '.meta.json', 'w', encoding='utf-8') as f:
+            json.dump(meta, f)
+        return table
+
+    def load(self, client, index_name: str) -> DecisionTable:
+        """
+        Get the decision table of an index as a DecisionTable object (see `get`)
+        :param client: StarChatClient object
+        :param index_name: name of the index
+        :return: DecisionTable object
+        """
+        return DecisionTable(self.get(client, index_name), version=client.version)
+
+    def invalidate(self, client, index_name: str) -> None:
+        """
+        Remove the cached dump of an index
+        :param client: StarChatClient object
+        :param index_name: name of the index
+        :return: None
+        """
+        base_path = self._base_path(client.address, index_name)
+        for suffix in ['.json.gz', '.meta.json']:
+            if path.isfile(base_path + suffix):
+                os.remove(base_path + suffix)
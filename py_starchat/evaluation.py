@@ -0,0 +1,170 @@
+import json
+import logging
+import random
+import string
+from collections import Counter
+from .shadow import _timed_response
+from .utilities import latency_summary, ordered_map
+
+logger = logging.getLogger(__name__)
+
+
+def _lowercase(text: str, rng: random.Random) -> str:
+    return text.lower()
+
+
+def _no_punctuation(text: str, rng: random.Random) -> str:
+    return text.translate(str.maketrans('', '', string.punctuation))
+
+
+def _typo(text: str, rng: random.Random) -> str:
+    """Swap two adjacent characters in a random word"""
+    words = text.split()
+    candidates = [i for i, word in enumerate(words) if len(word) > 3]
+    if not candidates:
+        return text
+    i = rng.choice(candidates)
+    j = rng.randrange(len(words[i]) - 1)
+    word = words[i]
+    words[i] = word[:j] + word[j + 1] + word[j] + word[j + 2:]
+    return ' '.join(words)
+
+
+def _drop_word(text: str, rng: random.Random) -> str:
+    words = text.split()
+    if len(words) < 3:
+        return text
+    del words[rng.randrange(len(words))]
+    return ' '.join(words)
+
+
+PERTURBATIONS = {
+    'lowercase': _lowercase,
+    'no_punctuation': _no_punctuation,
+    'typo': _typo,
+    'drop_word': _drop_word
+}
+
+
+def generate_corpus(decision_table, perturbations: list = (), variants: int = 1, use_keywords: bool = True,
+                    seed: int = 0):
+    """
+    Generate a labelled corpus of (utterance, expected state) pairs from the queries and the analyzer keywords of
+    a decision table
+    :param decision_table: DecisionTable object
+    :param perturbations: names of the perturbations (see PERTURBATIONS) applied to each query
+    :param variants: number of perturbed variants generated for each query and perturbation
+    :param use_keywords: if True, each analyzer keyword used by a single state is also used as an utterance
+    :param seed: seed of the random generator used by the perturbations
+    :return: generator of dict() records containing `text`, `state` and `source`
+             (`query`, `keyword` or `query+<perturbation>`)
+    """
+    rng = random.Random(seed)
+    keyword_index = decision_table.keyword_index() if use_keywords else dict()
+    for state_obj in decision_table.states:
+        queries = state_obj.queries if state_obj.has_queries() and isinstance(state_obj.queries, list) else []
+        for query in queries:
+            yield {'text': query, 'state': state_obj.state, 'source': 'query'}
+            for name in perturbations:
+                seen = {query}
+                for _ in range(variants):
+                    text = PERTURBATIONS[name](query, rng)
+                    if text not in seen:
+                        seen.add(text)
+                        yield {'text': text, 'state': state_obj.state, 'source': 'query+' + name}
+        if use_keywords:
+            for keyword in state_obj.get_keywords():
+                if len(set(keyword_index[keyword])) > 1:
+                    continue  # shared with other states, the expected state is ambiguous
+                yield {'text': keyword, 'state': state_obj.state, 'source': 'keyword'}
+
+
+def write_jsonl(records, corpus_path: str) -> int:
+    """
+    Write records to a jsonl file, one record per line
+    :param records: iterable of json-serializable objects
+    :param corpus_path: path to the output file
+    :return: number of records written
+    """
+    n = 0
+    with open(corpus_path, 'w', encoding='utf-8') as f:
+        for rec in records:
+            f.write(json.dumps(rec, ensure_ascii=False) + '\n')
+            n += 1
+    return n
+
+
+def read_jsonl(corpus_path: str):
+    """
+    Read records from a jsonl file
+    :param corpus_path: path to the jsonl file
+    :return: generator of records
+    """
+    with open(corpus_path, encoding='utf-8') as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+
+def evaluate(client, index_name: str, records, threshold: float = 0.01, max_workers: int = 8):
+    """
+    Send each utterance of a corpus to get_next_response concurrently (each one in a new conversation)
+    :param client: StarChatClient object
+    :param index_name: name of the index
+    :param records: iterable of dict() records with `text` and `state` (see `generate_corpus` and `read_jsonl`)
+    :param threshold: threshold used to filter StarChat answers
+    :param max_workers: number of concurrent requests
+    :return: generator of the input records (in input order) with the additional keys `predicted`, `latency`
+             and `correct` (and `error` if the request to StarChat failed)
+    """
+    def predict(numbered_rec):
+        n, rec = numbered_rec
+        answer = _timed_response(client, index_name, rec['text'], 'eval_{}'.format(n), threshold)
+        out = dict(rec)
+        out['predicted'] = answer['state']
+        out['latency'] = answer['latency']
+        out['correct'] = answer['state'] == rec['state']
+        if 'error' in answer:
+            out['error'] = answer['error']
+        return out
+
+    return ordered_map(predict, enumerate(records), max_workers)
+
+
+def evaluation_report(results) -> dict:
+    """
+    Summarize the results of `evaluate`
+    :param results: iterable of records returned by `evaluate`
+    :return: dict() with the number of failed requests, overall and per-state accuracy (failed requests count
+             as wrong answers), accuracy by source, the most common confusions
+             (expected_state, predicted_state) and the latency distribution (see `latency_summary`)
+    """
+    samples = Counter()
+    correct = Counter()
+    source_samples = Counter()
+    source_correct = Counter()
+    confusions = Counter()
+    latencies = []
+    errors = 0
+    for rec in results:
+        if 'error' in rec:
+            errors += 1
+        samples[rec['state']] += 1
+        source_samples[rec.get('source')] += 1
+        latencies.append(rec['latency'])
+        if rec['correct']:
+            correct[rec['state']] += 1
+            source_correct[rec.get('source')] += 1
+        elif 'error' not in rec:
+            confusions[(rec['state'], rec['predicted'])] += 1
+    n_samples = sum(samples.values())
+    return {
+        'samples': n_samples,
+        'errors': errors,
+        'accuracy': sum(correct.values()) / n_samples if n_samples else None,
+        'per_state': {state: {'samples': n, 'accuracy': correct[state] / n} for state, n in samples.items()},
+        'per_source': {source: {'samples': n, 'accuracy': source_correct[source] / n}
+                       for source, n in source_samples.items()},
+        'confusions': confusions.most_common(20),
+        'latency': latency_summary(latencies)
+    }
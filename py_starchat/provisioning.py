@@ -0,0 +1,181 @@
+import json
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, as_completed, wait
+from .tracing import tracer
+from .utilities import batches
+
+logger = logging.getLogger(__name__)
+
+
+def load_manifest(manifest_path: str) -> list:
+    """
+    Load a provisioning manifest. The manifest is a json list with one object per index, e.g.
+        [
+            {
+                "index_name": "index_getjenny_english_0",
+                "decision_table": "decision_tables/english.json",
+                "terms": "terms/english.jsonl"
+            },
+            ...
+        ]
+    `decision_table` and `terms` are optional. `terms` is either a list of term objects, a json file in the format
+    of schemas/add_term.json, or a jsonl file with one term object per line.
+    :param manifest_path: path to the manifest file
+    :return: list of dict() objects, one for each index
+    """
+    with open(manifest_path, encoding='utf-8') as f:
+        return json.load(f)
+
+
+def read_terms(terms):
+    """
+    Read term objects from a terms source (see `load_manifest`)
+    :param terms: list of term objects or path to a json/jsonl file
+    :return: generator of dict() objects with format as given in schemas/add_term.json
+    """
+    if isinstance(terms, list):
+        yield from terms
+    elif terms.endswith('.jsonl'):
+        with open(terms, encoding='utf-8') as f:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+    else:
+        with open(terms, encoding='utf-8') as f:
+            yield from json.load(f)['terms']
+
+
+def _count_states(decision_table_path: str) -> int:
+    with open(decision_table_path, encoding='utf-8') as f:
+        return len(json.load(f)['hits'])
+
+
+def _load_decision_table(client, index_name: str, decision_table_path: str, timeout: float, timings: dict):
+    t0 = time.perf_counter()
+    with tracer.span('provisioning.load_decision_table', index=index_name):
+        out = client.load_decision_table_file(index_name, decision_table_path)
+    timings['load_decision_table'] = time.perf_counter() - t0
+    if client.version_major == '4':
+        failed = [state for state, check in out.items() if not check]
+        if failed:
+            raise RuntimeError('{} states could not be loaded: {}'.format(len(failed), failed))
+    elif out.status_code != 200:
+        raise RuntimeError('StarChat returned status code {} loading the decision table'.format(out.status_code))
+    t0 = time.perf_counter()
+    with tracer.span('provisioning.wait_ready', index=index_name):
+        count = client.wait_for_states_count(index_name, expected=_count_states(decision_table_path),
+                                             timeout=timeout)
+    timings['wait_ready'] = time.perf_counter() - t0
+    if count is None:
+        raise RuntimeError('decision table not ready after {} seconds'.format(timeout))
+    return count
+
+
+def add_term_batch(client, index_name: str, batch: list):
+    """
+    Index a batch of terms, checking the StarChat output
+    :param client: StarChatClient object
+    :param index_name: name of the index
+    :param batch: list of term objects
+    :return: tuple (number of terms accepted by StarChat, list of ids of the rejected terms)
+    """
+    with tracer.span('provisioning.add_terms', index=index_name, terms=len(batch)):
+        out = client.add_term(index_name, batch)
+    if not isinstance(out, dict) or not isinstance(out.get('data'), list):
+        # StarChat returns an error object instead of the list of indexed terms (e.g. authentication failure)
+        raise RuntimeError('StarChat did not index the terms: {}'.format(out))
+    rejected = [item.get('id') for item in out['data'] if not 200 <= item.get('status', 200) < 300]
+    return len(out['data']) - len(rejected), rejected
+
+
+def _collect_term_batches(futures, report: dict) -> None:
+    for future in futures:
+        try:
+            accepted, rejected = future.result()
+        except Exception as e:
+            report['errors'].append('add_term: {!r}'.format(e))
+            continue
+        report['terms'] += accepted
+        if rejected:
+            report['errors'].append('add_term: {} terms rejected, e.g. {!r}'.format(len(rejected), rejected[0]))
+
+
+def provision_index(client, spec: dict, term_batch_size: int = 1000, max_workers: int = 4,
+                    timeout: float = 300) -> dict:
+    """
+    Create an index, load its decision table and its terms. Once the index is created, the decision table and
+    the term batches are loaded concurrently.
+    :param client: StarChatClient object
+    :param spec: dict() describing the index (see `load_manifest`)
+    :param term_batch_size: number of terms sent to StarChat in each add_term call
+    :param max_workers: number of concurrent requests to StarChat for this index
+    :param timeout: maximum time in seconds to wait for the decision table to be ready
+    :return: dict() report containing `index_name`, `states`, `terms`, `timings` (in seconds) and `errors`
+    """
+    index_name = spec['index_name']
+    timings = dict()
+    report = {'index_name': index_name, 'states': None, 'terms': 0, 'timings': timings, 'errors': []}
+    t_start = time.perf_counter()
+    try:
+        with tracer.span('provisioning.index_create', index=index_name):
+            response = client.index_create(index_name)
+        if response.status_code not in [200, 201]:
+            report['errors'].append('index_create: StarChat returned status code {}'.format(response.status_code))
+    except Exception as e:
+        report['errors'].append('index_create: {!r}'.format(e))
+    timings['index_create'] = time.perf_counter() - t_start
+    if report['errors']:
+        logger.warning('Provisioning of index "{}" failed: {}'.format(index_name, report['errors']))
+        timings['total'] = time.perf_counter() - t_start
+        return report
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        table_future = None
+        if spec.get('decision_table'):
+            table_future = executor.submit(_load_decision_table, client, index_name, spec['decision_table'],
+                                           timeout, timings)
+        if spec.get('terms'):
+            t0 = time.perf_counter()
+            pending = set()
+            try:
+                # keep at most 2 * max_workers batches in memory
+                for batch in batches(read_terms(spec['terms']), term_batch_size):
+                    pending.add(executor.submit(add_term_batch, client, index_name, batch))
+                    if len(pending) >= 2 * max_workers:
+                        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                        _collect_term_batches(done, report)
+            except Exception as e:
+                report['errors'].append('terms: {!r}'.format(e))
+            _collect_term_batches(wait(pending).done, report)
+            timings['add_terms'] = time.perf_counter() - t0
+        if table_future is not None:
+            try:
+                report['states'] = table_future.result()
+            except Exception as e:
+                report['errors'].append('decision_table: {}'.format(e))
+    timings['total'] = time.perf_counter() - t_start
+    if report['errors']:
+        logger.warning('Provisioning of index "{}" finished with errors: {}'.format(index_name, report['errors']))
+    else:
+        logger.info('Provisioned index "{}" in {:.1f} seconds'.format(index_name, timings['total']))
+    return report
+
+
+def provision(client, manifest: list, max_indices: int = 4, max_workers: int = 4, term_batch_size: int = 1000,
+              timeout: float = 300):
+    """
+    Provision all the indices of a manifest concurrently (see `provision_index`).
+    The client should be created with max_connections >= max_indices * max_workers.
+    :param client: StarChatClient object
+    :param manifest: list of dict() objects describing the indices (see `load_manifest`)
+    :param max_indices: number of indices provisioned at the same time
+    :param max_workers: number of concurrent requests to StarChat for each index
+    :param term_batch_size: number of terms sent to StarChat in each add_term call
+    :param timeout: maximum time in seconds to wait for each decision table to be ready
+    :return: generator of reports (as returned by `provision_index`), in order of completion
+    """
+    with ThreadPoolExecutor(max_workers=max_indices) as executor:
+        futures = [executor.submit(provision_index, client, spec, term_batch_size, max_workers, timeout)
+                   for spec in manifest]
+        for future in as_completed(futures):
+            yield future.result()
@@ -0,0 +1,110 @@
+import logging
+import time
+from collections import Counter
+from .utilities import latency_summary, ordered_map
+
+logger = logging.getLogger(__name__)
+
+
+def top_answer(response: list) -> dict:
+    """
+    Extract the top answer from the output of StarChatClient.get_next_response, for both 4.x and 5.x StarChat
+    :param response: StarChat output
+    :return: dict() containing `state`, `bubble` and `conversation_id` (None if StarChat returned no answer)
+    """
+    if not response:
+        return {'state': None, 'bubble': None, 'conversation_id': None}
+    answer = response[0]
+    return {
+        'state': answer.get('state'),
+        'bubble': answer.get('bubble'),
+        'conversation_id': answer.get('conversationId', answer.get('conversation_id'))
+    }
+
+
+def _timed_response(client, index_name: str, text: str, conversation_id: str, threshold: float) -> dict:
+    t0 = time.perf_counter()
+    try:
+        out = top_answer(client.get_next_response(index_name, text, conversation_id=conversation_id,
+                                                  threshold=threshold))
+    except Exception as e:
+        out = top_answer([])
+        out['error'] = repr(e)
+    out['latency'] = time.perf_counter() - t0
+    return out
+
+
+def shadow_compare(baseline: tuple, candidate: tuple, inputs, threshold: float = 0.01, max_workers: int = 8):
+    """
+    Send every input to two StarChat targets concurrently and compare the answers.
+    Targets can be two indices on the same server or indices on different servers (also with different
+    StarChat versions).
+    :param baseline: tuple (StarChatClient object, index name) of the reference target
+    :param candidate: tuple (StarChatClient object, index name) of the target to be compared
+    :param inputs: iterable of texts, or of dict() objects with `text` and optional `conversation_id` keys
+    :param threshold: threshold used to filter StarChat answers
+    :param max_workers: number of concurrent requests
+    :return: generator of dict() records (one for each input, in input order) containing `text`, the top answer
+             and latency of each target (`baseline`, `candidate`), `same_state` and `same_bubble`
+    """
+    def calls():
+        for n, el in enumerate(inputs):
+            if isinstance(el, str):
+                text, conversation_id = el, 'shadow_{}'.format(n)
+            else:
+                text, conversation_id = el['text'], el.get('conversation_id', 'shadow_{}'.format(n))
+            for client, index_name in [baseline, candidate]:
+                yield client, index_name, text, conversation_id
+
+    def send(request):
+        return request[2], _timed_response(*request, threshold)
+
+    # the requests of each input to the two targets are consecutive, so they are sent at the same time
+    responses = ordered_map(send, calls(), max_workers)
+    for (text, baseline_out), (_, candidate_out) in zip(responses, responses):
+        yield _compare(text, baseline_out, candidate_out)
+
+
+def _compare(text: str, baseline: dict, candidate: dict) -> dict:
+    return {
+        'text': text,
+        'baseline': baseline,
+        'candidate': candidate,
+        'same_state': baseline['state'] == candidate['state'],
+        'same_bubble': baseline['bubble'] == candidate['bubble']
+    }
+
+
+def shadow_summary(records) -> dict:
+    """
+    Summarize the records returned by `shadow_compare`
+    :param records: iterable of records
+    :return: dict() with the number of inputs and mismatches, the most common state changes and the latency
+             distribution of each target (see `latency_summary`)
+    """
+    n_inputs = 0
+    state_mismatches = 0
+    bubble_mismatches = 0
+    errors = Counter()
+    state_changes = Counter()
+    latencies = {'baseline': [], 'candidate': []}
+    for rec in records:
+        n_inputs += 1
+        if not rec['same_state']:
+            state_mismatches += 1
+            state_changes[(rec['baseline']['state'], rec['candidate']['state'])] += 1
+        if not rec['same_bubble']:
+            bubble_mismatches += 1
+        for target in ['baseline', 'candidate']:
+            latencies[target].append(rec[target]['latency'])
+            if 'error' in rec[target]:
+                errors[target] += 1
+    return {
+        'inputs': n_inputs,
+        'state_mismatches': state_mismatches,
+        'bubble_mismatches': bubble_mismatches,
+        'errors': dict(errors),
+        'state_changes': state_changes.most_common(20),
+        'baseline_latency': latency_summary(latencies['baseline']),
+        'candidate_latency': latency_summary(latencies['candidate'])
+    }
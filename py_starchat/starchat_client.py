@@ -1,24 +1,94 @@
+import heapq
 import json
 import time
 import logging
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
 import requests
 from .utilities import get_major_version
+from .tracing import tracer, traced
 
 logger = logging.getLogger(__name__)
 
 
+def _check_list_of(values, el_type: type, message: str) -> None:
+    """
+    Check that values is a list of el_type objects
+    :raises TypeError: if the check fails
+    """
+    if type(values) != list or not all(isinstance(el, el_type) for el in values):
+        raise TypeError(message)
+
+
+def _to_json(obj):
+    """
+    Serialize objects not supported by the json module (numpy arrays and scalars)
+    """
+    if hasattr(obj, 'tolist'):
+        return obj.tolist()
+    raise TypeError('Object of type {} is not JSON serializable'.format(type(obj).__name__))
+
+
 class StarChatClient:
 
     def __init__(self,
                  url: str = 'http://localhost',
                  port: str = '8888',
-                 version: str = '5.1') -> None:
+                 version: str = '5.1',
+                 max_connections: int = 10) -> None:
 
         self.address = '{}:{}'.format(url, port)
         self.session = requests.Session()
+        # connection pool size, should be at least the number of threads sharing the client
+        adapter = requests.adapters.HTTPAdapter(pool_connections=max_connections, pool_maxsize=max_connections)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
         assert version in ['4.1', '4.2', '5.1']
         self.version = version
         self.version_major = get_major_version(version)
+        # tokenizer definitions for each index as (fetch time, definitions), used when tokenizing with a cache.
+        # Definitions older than tokenizers_ttl seconds are fetched again from StarChat
+        self._tokenizers = dict()
+        self.tokenizers_ttl = 300.
+
+    def _request(self, method: str, url: str, **kwargs):
+        """
+        Send a request to StarChat through the client session.
+        When tracing, the `http_request` span records `request_to_headers_ms` (response.elapsed): the time from
+        sending the request to parsing the response headers. requests does not expose connection acquisition
+        separately, so this time also includes getting a connection from the pool, the TCP/TLS handshake for new
+        connections and sending the body.
+        :param method: http method (e.g. 'get', 'post')
+        :param url: url of the request
+        :param kwargs: additional arguments passed to requests
+        :return: StarChat response
+        """
+        with tracer.span('http_request', method=method.upper(), url=url) as span:
+            response = self.session.request(method, url, **kwargs)
+            span.set(status_code=response.status_code,
+                     request_to_headers_ms=response.elapsed.total_seconds() * 1000)
+        return response
+
+    def _post_json(self, url: str, body):
+        """
+        Encode body as json and post it to StarChat
+        :param url: url of the request
+        :param body: json-serializable object
+        :return: StarChat response
+        """
+        with tracer.span('json_encode') as span:
+            data = json.dumps(body, default=_to_json, allow_nan=False).encode('utf-8')
+            span.set(bytes=len(data))
+        return self._request('post', url, data=data, headers={'Content-Type': 'application/json'})
+
+    @staticmethod
+    def _json(response):
+        """
+        Decode the json content of a StarChat response
+        :param response: StarChat response
+        :return: decoded json content
+        """
+        with tracer.span('json_decode', bytes=len(response.content)):
+            return response.json()
 
     def authenticate(self, user: str, password: str) -> None:
         """
@@ -35,7 +105,7 @@ class StarChatClient:
         Check connection to StarChat
         :return: True if connection to starChat returned status code 200, False otherwise
         """
-        response = self.session.get(self.address)
+        response = self._request('get', self.address)
         try:
             assert response.status_code == 200
             return True
@@ -43,13 +113,14 @@ class StarChatClient:
             logger.info('Something went wrong connecting to StarChat on {}'.format(self.address))
             return False
 
+    @traced
     def get_indices(self):
         """
         Get all StarChat indices
         :return: list containing names of indices (including `starchat_system` indices)
         """
-        response = self.session.get('{}/system_indices'.format(self.address))
-        return response.json()
+        response = self._request('get', '{}/system_indices'.format(self.address))
+        return self._json(response)
 
     def index_exists(self, index_name: str) -> bool:
         """
@@ -57,11 +128,11 @@ class StarChatClient:
         :param index_name: name of the index
         :return: True if index already present, False otherwise
         """
-        response = self.session.get('{}/{}/index_management'.format(self.address, index_name))
+        response = self._request('get', '{}/{}/index_management'.format(self.address, index_name))
         if self.version == '4.1':
-            res = response.json()['message'] == 'IndexCheck: state({}.state, true) question({}.question, true) term({}.term, true)'.format(*([index_name] * 3))
+            res = self._json(response)['message'] == 'IndexCheck: state({}.state, true) question({}.question, true) term({}.term, true)'.format(*([index_name] * 3))
         else:
-            res = response.json()['check']
+            res = self._json(response)['check']
         return res
 
     def index_delete(self, index_name: str):
@@ -70,7 +141,7 @@ class StarChatClient:
         :param index_name: name opf the index to be deleted
         :return: StarChat response
         """
-        response = self.session.delete('{}/{}/index_management'.format(self.address, index_name))
+        response = self._request('delete', '{}/{}/index_management'.format(self.address, index_name))
         return response
 
     def index_create(self, index_name: str):
@@ -79,7 +150,7 @@ class StarChatClient:
         :param index_name: name of the index to be created
         :return: StarChat response
         """
-        response = self.session.post('{}/{}/index_management/create'.format(self.address, index_name))
+        response = self._request('post', '{}/{}/index_management/create'.format(self.address, index_name))
         return response
 
     def load_decision_table(self, index_name: str, json: dict):
@@ -90,8 +161,7 @@ class StarChatClient:
         :return: StarChat response
         """
         if self.version_major == '4':
-            response = self.session.post('{}/{}/decisiontable'.format(self.address, index_name),
-                                         json=json)
+            response = self._post_json('{}/{}/decisiontable'.format(self.address, index_name), json)
             return response
         # TODO: modify to work also with starchat version 5.1
         # elif self.version == '5.1':
@@ -99,6 +169,7 @@ class StarChatClient:
         #                                  json=json)
         # return response
 
+    @traced
     def load_decision_table_file(self, index_name: str, decision_table_path: str):
         """
         Load decision table in json format to starchat index
@@ -126,19 +197,31 @@ class StarChatClient:
             return out
         elif self.version == '5.1':
             files = {'json': open(decision_table_path, 'rb')}
-            response = self.session.post('{}/{}/decisiontable/upload/json'.format(self.address, index_name),
-                                         files=files)
+            response = self._request('post', '{}/{}/decisiontable/upload/json'.format(self.address, index_name),
+                                     files=files)
             return response
 
+    @traced
     def decision_table_dump(self, index_name):
         """
         Get the decision table loaded for a StarChat index
         :param index_name: name of the index
         :return: dict containing the decision table
         """
-        response = self.session.get('{}/{}/decisiontable?dump=true'.format(self.address, index_name))
-        return response.json()
+        response = self._request('get', '{}/{}/decisiontable?dump=true'.format(self.address, index_name))
+        return self._json(response)
+
+    def _states_count_endpoint(self, index_name: str):
+        """
+        Get the url of the decision table analyzer and the label of the number of entries in its response
+        :return: tuple (url, label)
+        """
+        if self.version_major == '4':
+            return '{}/{}/decisiontable_analyzer'.format(self.address, index_name), 'num_of_entries'
+        else:
+            return '{}/{}/decisiontable/analyzer'.format(self.address, index_name), 'numOfEntries'
 
+    @traced
     def states_count(self, index_name: str, patience_time: int = 5, trials: int = 5):
         """
         Return number of states loaded in index.
@@ -147,26 +230,50 @@ class StarChatClient:
         :param trials: maximum number of calls to StarChat before giving up if request time out
         :return: int specifying the number of entries that are present in the index
         """
-        if self.version_major == '4':
-            url = '{}/{}/decisiontable_analyzer'.format(self.address, index_name)
-            label = 'num_of_entries'
-        else:
-            url = '{}/{}/decisiontable/analyzer'.format(self.address, index_name)
-            label = 'numOfEntries'
-        response = self.session.post(url)
+        url, label = self._states_count_endpoint(index_name)
+        response = self._request('post', url)
         counter = 0
         while response.status_code != 200 and counter < trials:
             counter += 1
             logger.info('StarChatClient.states_count: giving some time to StarChat...')
             time.sleep(patience_time)
-            response = self.session.post(url)
+            response = self._request('post', url)
         try:
             assert response.status_code == 200
-            return response.json()[label]
+            return self._json(response)[label]
         except AssertionError:
             logger.warning('Something went wrong checking the number of entries in index "{}"'.format(index_name))
             return None
 
+    @traced
+    def wait_for_states_count(self, index_name: str, expected: int = None, timeout: float = 300,
+                              initial_delay: float = 0.1, max_delay: float = 5.0):
+        """
+        Wait until the decision table of the index is available, polling StarChat with exponential backoff
+        :param index_name: name of the index
+        :param expected: number of states expected in the index. If None, wait until StarChat returns any count
+        :param timeout: maximum time in seconds to wait
+        :param initial_delay: time in seconds before the second call to StarChat, doubled at each call
+        :param max_delay: maximum time in seconds between two calls to StarChat
+        :return: number of entries in the index, or None if the index was not ready before the timeout
+        """
+        url, label = self._states_count_endpoint(index_name)
+        deadline = time.monotonic() + timeout
+        delay = initial_delay
+        while True:
+            response = self._request('post', url)
+            count = self._json(response)[label] if response.status_code == 200 else None
+            if count is not None and (expected is None or count == expected):
+                return count
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                logger.warning('Index "{}" not ready after {} seconds (entries: {}, expected: {})'
+                               .format(index_name, timeout, count, expected))
+                return None
+            time.sleep(min(delay, remaining))
+            delay = min(2 * delay, max_delay)
+
+    @traced
     def get_next_response(self, index_name: str, text: str, conversation_id: str = '42', threshold: float = 0.01):
         """
         Get answer from StarChat (see `/<index_name>/get_next_response` API in StarChat documentation)
@@ -200,13 +307,13 @@ class StarChatClient:
                 },
                 "threshold": threshold
             }
-        response = self.session.post('{}/{}/get_next_response'.format(self.address, index_name),
-                                     json=body)
+        response = self._post_json('{}/{}/get_next_response'.format(self.address, index_name), body)
         if response.status_code == 200:
-            return response.json()
+            return self._json(response)
         else:
             return []
 
+    @traced
     def get_term(self, index_name: str, terms: list):
         """
         Retrieve a list of terms from the terms table
@@ -214,27 +321,33 @@ class StarChatClient:
         :param terms: list of strings corresponding to terms to be retrieved
         :return: dict containing starchat output
         """
-        assert type(terms) == list, 'Argument `terms` should be a list of strings'
-        assert all([type(el) == str for el in terms]), 'Argument `terms` should be a list of strings'
+        _check_list_of(terms, str, 'Argument `terms` should be a list of strings')
         body = {"ids": terms}
-        response = self.session.post('{}/{}/term/get'.format(self.address, index_name),
-                                     json=body)
-        return response.json()
+        response = self._post_json('{}/{}/term/get'.format(self.address, index_name), body)
+        return self._json(response)
 
-    def add_term(self, index_name: str, terms: list):
+    @traced
+    def add_term(self, index_name: str, terms: list, validator=None):
         """
         Index terms in a StarChat index
         :param index_name: name of the index
-        :param terms: list of dict objects with format as given in schemas/add_term.json
+        :param terms: list of dict objects with format as given in schemas/add_term.json. Vectors can be given
+                      as lists or as numpy arrays
+        :param validator: optional TermValidator object. When given, the whole batch is validated before
+                          sending anything to StarChat and ValueError is raised if any term is invalid
         :return: dict containing starchat output
         """
-        assert type(terms) == list, 'Argument `terms` should be a list of json objects'
-        assert all([type(el) == dict for el in terms]), 'Argument `terms` should be a list of json objects'
+        _check_list_of(terms, dict, 'Argument `terms` should be a list of json objects')
+        if validator is not None:
+            terms, invalid = validator.validate_batch(terms)
+            if invalid:
+                raise ValueError('{} invalid terms, e.g. term {}: {}'.format(len(invalid), invalid[0][0],
+                                                                              invalid[0][2]))
         body = {'terms': terms}
-        response = self.session.post('{}/{}/term/index'.format(self.address, index_name),
-                                     json=body)
-        return response.json()
+        response = self._post_json('{}/{}/term/index'.format(self.address, index_name), body)
+        return self._json(response)
 
+    @traced
     def delete_term(self, index_name: str, terms: list):
         """
         Delete terms in a StarChat index
@@ -242,13 +355,12 @@ class StarChatClient:
         :param terms: list of strings corresponding to terms to be deleted
         :return: dict containing starchat output
         """
-        assert type(terms) == list, 'Argument `terms` should be a list of strings'
-        assert all([type(el) == str for el in terms]), 'Argument `terms` should be a list of strings'
+        _check_list_of(terms, str, 'Argument `terms` should be a list of strings')
         body = {'ids': terms}
-        response = self.session.post('{}/{}/term/delete'.format(self.address, index_name),
-                                     json=body)
-        return response.json()
+        response = self._post_json('{}/{}/term/delete'.format(self.address, index_name), body)
+        return self._json(response)
 
+    @traced
     def term_distance(self, index_name: str, terms: list):
         """
         Compute all the pairwise distances between the listed terms
@@ -256,12 +368,111 @@ class StarChatClient:
         :param terms: list of strings corresponding to terms to be compared
         :returns: dict containing starchat output
         """
-        assert type(terms) == list, 'Argument `terms` should be a list of strings'
-        assert all([type(el) == str for el in terms]), 'Argument `terms` should be a list of strings'
+        _check_list_of(terms, str, 'Argument `terms` should be a list of strings')
         body = {'ids': terms}
-        response = self.session.post('{}/{}/term/distance'.format(self.address, index_name),
-                                     json=body)
-        return response.json()
+        response = self._post_json('{}/{}/term/distance'.format(self.address, index_name), body)
+        return self._json(response)
+
+    def _term_distance_tile(self, index_name: str, block_1: list, block_2: list):
+        """
+        Compute the distances between the terms of two blocks (or within a block if the two blocks are the same)
+        :return: list of StarChat distance records
+        :raises requests.HTTPError: if StarChat does not return the distances for the tile
+        """
+        same_block = block_1 is block_2
+        ids = block_1 if same_block else block_1 + block_2
+        response = self._post_json('{}/{}/term/distance'.format(self.address, index_name), {'ids': ids})
+        if response.status_code != 200:
+            logger.error('Something went wrong computing term distances on index "{}" (status code {})'
+                         .format(index_name, response.status_code))
+            response.raise_for_status()
+            raise requests.HTTPError('Unexpected status code {}'.format(response.status_code), response=response)
+        records = self._json(response)
+        if same_block:
+            return records
+        set_1, set_2 = set(block_1), set(block_2)
+        return [rec for rec in records
+                if (rec['term1'] in set_1 and rec['term2'] in set_2) or
+                   (rec['term1'] in set_2 and rec['term2'] in set_1)]
+
+    def term_distance_blocked(self, index_name: str, terms: list, block_size: int = 200, max_workers: int = 4,
+                              top_k: int = None, metric: str = 'cosDistance'):
+        """
+        Compute all the pairwise distances between the listed terms, splitting the term list in blocks and
+        requesting the distances for each pair of blocks concurrently. Memory usage is bounded by the number of
+        tiles in flight (2 * max_workers) instead of by the total number of pairs.
+        :param index_name: name of the index
+        :param terms: list of strings corresponding to terms to be compared
+        :param block_size: number of terms in each block
+        :param max_workers: number of concurrent requests to StarChat
+        :param top_k: if given, only the top_k closest terms (according to metric) of each term are returned.
+                      In this case, records are yielded once all tiles are computed, grouped by term
+        :param metric: distance used to rank terms when top_k is given (`cosDistance` or `eucDistance`)
+        :return: generator of StarChat distance records (dict objects with `term1`, `term2`, `cosDistance`,
+                 `eucDistance`, ...), in no particular order
+        :raises requests.HTTPError: if StarChat fails to compute the distances of a tile
+        """
+        _check_list_of(terms, str, 'Argument `terms` should be a list of strings')
+        terms = list(dict.fromkeys(terms))  # remove duplicates, keeping order
+        blocks = [terms[i:i + block_size] for i in range(0, len(terms), block_size)]
+        tiles = ((blocks[i], blocks[j]) for i in range(len(blocks)) for j in range(i, len(blocks)))
+        records = self._iter_tiles(index_name, tiles, max_workers)
+        if top_k is None:
+            yield from records
+            return
+        nearest = {term: [] for term in terms}  # term: heap of (-distance, other_term, record)
+        for rec in records:
+            for term, other in [(rec['term1'], rec['term2']), (rec['term2'], rec['term1'])]:
+                heap = nearest.get(term)
+                if heap is None or any(el[1] == other for el in heap):
+                    continue
+                item = (-rec[metric], other, rec)
+                if len(heap) < top_k:
+                    heapq.heappush(heap, item)
+                elif item[0] > heap[0][0]:
+                    heapq.heapreplace(heap, item)
+        for term in terms:
+            for _, _, rec in sorted(nearest[term], key=lambda el: (-el[0], el[1])):
+                yield rec
+
+    def _iter_tiles(self, index_name: str, tiles, max_workers: int):
+        """
+        Request the tiles concurrently, keeping at most 2 * max_workers tiles in flight
+        :return: generator of StarChat distance records
+        """
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            pending = set()
+            for block_1, block_2 in tiles:
+                pending.add(executor.submit(self._term_distance_tile, index_name, block_1, block_2))
+                if len(pending) >= 2 * max_workers:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        yield from future.result()
+            for future in pending:
+                yield from future.result()
+
+    def term_distance_matrix(self, index_name: str, terms: list, metric: str = 'cosDistance',
+                             block_size: int = 200, max_workers: int = 4):
+        """
+        Compute the dense matrix of pairwise distances between the listed terms (see `term_distance_blocked`)
+        :param index_name: name of the index
+        :param terms: list of strings corresponding to terms to be compared
+        :param metric: distance stored in the matrix (`cosDistance` or `eucDistance`)
+        :param block_size: number of terms in each block
+        :param max_workers: number of concurrent requests to StarChat
+        :return: numpy array of shape (len(terms), len(terms)). Distances not returned by StarChat
+                 (i.e. for terms without vector) are set to NaN
+        :raises requests.HTTPError: if StarChat fails to compute the distances of a tile
+        """
+        import numpy as np
+        terms = list(dict.fromkeys(terms))
+        position = {term: i for i, term in enumerate(terms)}
+        matrix = np.full((len(terms), len(terms)), np.nan, dtype='float32')
+        np.fill_diagonal(matrix, 0.)
+        for rec in self.term_distance_blocked(index_name, terms, block_size=block_size, max_workers=max_workers):
+            i, j = position[rec['term1']], position[rec['term2']]
+            matrix[i, j] = matrix[j, i] = rec[metric]
+        return matrix
 
     def get_tokenizers(self, index_name):
         """
@@ -269,27 +480,50 @@ class StarChatClient:
         :param index_name: name of the index
         :return: dict containing the tokenizer definitions
         """
-        response = self.session.get('{}/{}/tokenizers'.format(self.address, index_name))
-        return response.json()
+        response = self._request('get', '{}/{}/tokenizers'.format(self.address, index_name))
+        return self._json(response)
 
-    def tokenize(self, index_name: str, text: str, tokenizer: str = "base"):
+    def clear_tokenizers(self) -> None:
+        """
+        Forget the tokenizer definitions stored by `tokenize`, so that they are fetched again from StarChat
+        :return: None
+        """
+        self._tokenizers = dict()
+
+    @traced
+    def tokenize(self, index_name: str, text: str, tokenizer: str = "base", cache=None):
         """
         Tokenize text
         :param index_name: name of the index
         :param text: text to be tokenized
         :param tokenizer: tokenizer to be used
+        :param cache: optional TokenCache object. When given, tokens are read from and stored in the cache
         :returns: list containing the tokens
+
+        Tokenizer definitions are fetched from StarChat at most once every `tokenizers_ttl` seconds per index, or
+        again when the tokenizer is not among the stored ones (see `clear_tokenizers`)
         """
         # check tokenizer
-        tokenizers = self.get_tokenizers(index_name)
+        fetched_at, tokenizers = self._tokenizers.get(index_name, (None, None))
+        if fetched_at is None or time.monotonic() - fetched_at > self.tokenizers_ttl or tokenizer not in tokenizers:
+            tokenizers = self.get_tokenizers(index_name)
+            self._tokenizers[index_name] = (time.monotonic(), tokenizers)
         assert tokenizer in tokenizers, 'Tokenizer {} not found for index {}'.format(tokenizer, index_name)
+        if cache is not None:
+            key = cache.key(index_name, tokenizer, cache.definition_hash(tokenizers[tokenizer]), text)
+            tokens = cache.get(key)
+            if tokens is not None:
+                return tokens
         # call starchat to tokenize text
         body = {
             "tokenizer": tokenizer,
             "text": text
         }
-        response = self.session.post('{}/{}/tokenizers'.format(self.address, index_name), json=body)
-        return response.json()['tokens']
+        response = self._post_json('{}/{}/tokenizers'.format(self.address, index_name), body)
+        tokens = self._json(response)['tokens']
+        if cache is not None:
+            cache.set(key, tokens)
+        return tokens
 
     def close(self):
         self.session.close()
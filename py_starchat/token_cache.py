@@ -0,0 +1,142 @@
+import hashlib
+import json
+import logging
+import sqlite3
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class TokenCache:
+    """
+    Persistent cache for StarChat tokenizer outputs, stored in a SQLite file.
+    Entries are addressed by the hash of (index, tokenizer, tokenizer definition, text): if the tokenizer
+    definition changes on StarChat, old entries are not used anymore and are eventually evicted.
+    """
+
+    def __init__(self, cache_path: str, max_entries: int = 1000000, touch_interval: float = 3600,
+                 touch_batch_size: int = 1000):
+        """
+        :param cache_path: path to the SQLite file (created if missing)
+        :param max_entries: maximum number of entries kept in the cache. When exceeded, the least recently
+                            used entries are evicted
+        :param touch_interval: the access time of an entry is updated only if older than touch_interval seconds
+        :param touch_batch_size: access time updates are buffered and written in batches of this size
+        """
+        self.cache_path = cache_path
+        self.max_entries = max_entries
+        self.touch_interval = touch_interval
+        self.touch_batch_size = touch_batch_size
+        self._touched = []  # keys whose access time has to be updated
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(cache_path, check_same_thread=False)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        self._conn.execute('CREATE TABLE IF NOT EXISTS tokens '
+                           '(key BLOB PRIMARY KEY, tokens TEXT NOT NULL, accessed REAL NOT NULL) WITHOUT ROWID')
+        self._conn.execute('CREATE INDEX IF NOT EXISTS tokens_accessed ON tokens (accessed)')
+        self._conn.commit()
+        self._size = self._conn.execute('SELECT COUNT(*) FROM tokens').fetchone()[0]
+
+    def __len__(self):
+        return self._size
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        self.close()
+        return False
+
+    @staticmethod
+    def definition_hash(definition) -> str:
+        """
+        Hash of a tokenizer definition, as returned by StarChatClient.get_tokenizers
+        :param definition: tokenizer definition
+        :return: hexadecimal digest
+        """
+        return hashlib.sha256(json.dumps(definition, sort_keys=True).encode('utf-8')).hexdigest()
+
+    @staticmethod
+    def key(index_name: str, tokenizer: str, definition_hash: str, text: str) -> bytes:
+        """
+        Content address of a tokenization
+        :param index_name: name of the index
+        :param tokenizer: name of the tokenizer
+        :param definition_hash: hash of the tokenizer definition (see `definition_hash`)
+        :param text: tokenized text
+        :return: 32 bytes digest
+        """
+        return hashlib.sha256('\x00'.join([index_name, tokenizer, definition_hash, text]).encode('utf-8')).digest()
+
+    def get(self, key: bytes):
+        """
+        Retrieve cached tokens
+        :param key: content address (see `key`)
+        :return: list of tokens, or None if not cached
+        """
+        with self._lock:
+            row = self._conn.execute('SELECT tokens, accessed FROM tokens WHERE key = ?', (key,)).fetchone()
+            if row is None:
+                return None
+            if time.time() - row[1] > self.touch_interval:
+                self._touched.append(key)
+                if len(self._touched) >= self.touch_batch_size:
+                    self._flush_touched()
+                    self._conn.commit()
+        return json.loads(row[0])
+
+    def _flush_touched(self) -> None:
+        if self._touched:
+            now = time.time()
+            self._conn.executemany('UPDATE tokens SET accessed = ? WHERE key = ?',
+                                   [(now, key) for key in self._touched])
+            self._touched = []
+
+    def set(self, key: bytes, tokens: list) -> None:
+        """
+        Store tokens in the cache, evicting the least recently used entries if the cache is full
+        :param key: content address (see `key`)
+        :param tokens: list of tokens returned by StarChat
+        :return: None
+        """
+        value = json.dumps(tokens, separators=(',', ':'), ensure_ascii=False)
+        with self._lock:
+            exists = self._conn.execute('SELECT 1 FROM tokens WHERE key = ?', (key,)).fetchone()
+            self._conn.execute('INSERT OR REPLACE INTO tokens (key, tokens, accessed) VALUES (?, ?, ?)',
+                               (key, value, time.time()))
+            if exists is None:
+                self._size += 1
+            if self._size > self.max_entries:
+                self._flush_touched()
+                self._evict()
+            self._conn.commit()
+
+    def _evict(self) -> None:
+        # evict 10% of the entries at once so that eviction is not triggered on every insert
+        n_evict = self._size - self.max_entries + max(1, self.max_entries // 10)
+        logger.debug('TokenCache: evicting {} entries from {}'.format(n_evict, self.cache_path))
+        self._conn.execute('DELETE FROM tokens WHERE key IN '
+                           '(SELECT key FROM tokens ORDER BY accessed LIMIT ?)', (n_evict,))
+        self._size = self._conn.execute('SELECT COUNT(*) FROM tokens').fetchone()[0]
+
+    def clear(self) -> None:
+        with self._lock:
+            self._touched = []
+            self._conn.execute('DELETE FROM tokens')
+            self._conn.commit()
+            self._size = 0
+
+    def flush(self) -> None:
+        """
+        Write the buffered access time updates to the SQLite file
+        :return: None
+        """
+        with self._lock:
+            self._flush_touched()
+            self._conn.commit()
+
+    def close(self) -> None:
+        self.flush()
+        self._conn.close()
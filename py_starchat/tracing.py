@@ -0,0 +1,150 @@
+import functools
+import json
+import os
+import threading
+import time
+
+
+class _Span:
+    """
+    A span being recorded. Arguments can be added while the span is open and are exported in the trace event
+    """
+
+    def __init__(self, tracer, name: str, args: dict):
+        self.tracer = tracer
+        self.name = name
+        self.args = args
+        self.start = None
+
+    def set(self, **args) -> None:
+        self.args.update(args)
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        end = time.perf_counter()
+        if exc_type is not None:
+            self.args['error'] = exc_type.__name__
+        self.tracer.add_event(self.name, self.start, end, self.args)
+        return False
+
+
+class _NullSpan:
+    """Span returned when tracing is disabled: it does nothing"""
+
+    def set(self, **args) -> None:
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        return False
+
+
+_NULL_SPAN = _NullSpan()
+
+
+class Tracer:
+    """
+    Collect nested spans and export them in the Chrome trace-event format
+    (open the exported file in chrome://tracing or https://ui.perfetto.dev to get a flame timeline)
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.events = []
+        self._lock = threading.Lock()
+        self._origin = time.perf_counter()
+
+    def enable(self) -> None:
+        self.enabled = True
+
+    def disable(self) -> None:
+        self.enabled = False
+
+    def clear(self) -> None:
+        with self._lock:
+            self.events = []
+        self._origin = time.perf_counter()
+
+    def span(self, name: str, **args):
+        """
+        Context manager recording the time spent in the enclosed block
+        :param name: name of the span
+        :param args: additional information stored in the trace event
+        :return: span object. Use its `set` method to add information while the span is open
+        """
+        if not self.enabled:
+            return _NULL_SPAN
+        return _Span(self, name, args)
+
+    def add_event(self, name: str, start: float, end: float, args: dict) -> None:
+        event = {
+            'name': name,
+            'cat': name.split('.')[0],
+            'ph': 'X',
+            'ts': (start - self._origin) * 1e6,
+            'dur': (end - start) * 1e6,
+            'pid': os.getpid(),
+            'tid': threading.get_ident(),
+            'args': args
+        }
+        with self._lock:
+            self.events.append(event)
+
+    def export(self, trace_path: str) -> None:
+        """
+        Write the recorded spans to a json file in Chrome trace-event format
+        :param trace_path: path to the output file
+        :return: None
+        """
+        with self._lock:
+            events = list(self.events)
+        with open(trace_path, 'w', encoding='utf-8') as f:
+            json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, f, default=str)
+
+
+tracer = Tracer()
+
+
+def enable_tracing() -> None:
+    """
+    Start recording spans for StarChatClient and DecisionTable calls
+    :return: None
+    """
+    tracer.enable()
+
+
+def disable_tracing() -> None:
+    """
+    Stop recording spans. Spans already recorded are kept until `tracer.clear()` is called
+    :return: None
+    """
+    tracer.disable()
+
+
+def export_trace(trace_path: str) -> None:
+    """
+    Write the recorded spans to a json file in Chrome trace-event format
+    :param trace_path: path to the output file
+    :return: None
+    """
+    tracer.export(trace_path)
+
+
+def traced(func):
+    """
+    Decorator recording a span named after the decorated function (e.g. `StarChatClient.add_term`)
+    """
+    name = func.__qualname__
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        if not tracer.enabled:
+            return func(*args, **kwargs)
+        with tracer.span(name):
+            return func(*args, **kwargs)
+    return wrapper
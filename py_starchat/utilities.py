@@ -1,4 +1,6 @@
 # utility functions
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 
 
 def get_major_version(version: str) -> str:
@@ -8,3 +10,61 @@ def get_major_version(version: str) -> str:
     :return: major version as a string
     """
     return version.split('.')[0]
+
+
+def latency_summary(latencies: list) -> dict:
+    """
+    Summarize a list of latencies
+    :param latencies: list of latencies in seconds
+    :return: dict containing count, mean, p50, p90, p99 and max of the latencies (in seconds)
+    """
+    if not latencies:
+        return {'count': 0}
+    values = sorted(latencies)
+
+    def percentile(q):
+        return values[min(len(values) - 1, int(round(q / 100 * (len(values) - 1))))]
+
+    return {
+        'count': len(values),
+        'mean': sum(values) / len(values),
+        'p50': percentile(50),
+        'p90': percentile(90),
+        'p99': percentile(99),
+        'max': values[-1]
+    }
+
+
+def batches(iterable, batch_size: int):
+    """
+    Split an iterable in lists of batch_size elements (the last one can be shorter)
+    :param iterable: iterable to be split
+    :param batch_size: number of elements in each batch
+    :return: generator of lists
+    """
+    batch = []
+    for el in iterable:
+        batch.append(el)
+        if len(batch) == batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def ordered_map(func, iterable, workers: int):
+    """
+    Apply func to the elements of iterable using a thread pool, keeping at most 2 * workers elements in flight
+    :param func: function to be applied
+    :param iterable: iterable of arguments of func
+    :param workers: number of threads
+    :return: generator of the results, in input order
+    """
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        pending = deque()
+        for el in iterable:
+            pending.append(executor.submit(func, el))
+            if len(pending) >= 2 * workers:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
@@ -0,0 +1,220 @@
+import json
+import math
+import numbers
+from collections import Counter
+
+# field types of a term object, as in schemas/add_term.json
+TERM_EXAMPLE = {
+    "term": "hello",
+    "synonyms": {"hi": 0.6},
+    "antonyms": {"goodbye": 0.3},
+    "tags": "tag1 tag2",
+    "features": {"POS": "name"},
+    "frequencyBase": 410301,
+    "frequencyStem": 601301,
+    "vector": [0., -1., 2., 1.2, 3.],
+    "score": 0.9
+}
+
+
+def _is_number(value) -> bool:
+    return isinstance(value, numbers.Real) and not isinstance(value, bool) and math.isfinite(value)
+
+
+def _is_integer(value) -> bool:
+    return isinstance(value, numbers.Integral) and not isinstance(value, bool)
+
+
+def _check_for(example):
+    """
+    Build the check function for a field, given an example value
+    :param example: example value of the field
+    :return: function returning an error message for invalid values, None for valid ones
+    """
+    if isinstance(example, str):
+        return lambda value: None if isinstance(value, str) else 'should be a string'
+    if isinstance(example, bool):
+        return lambda value: None if isinstance(value, bool) else 'should be a boolean'
+    if isinstance(example, numbers.Integral):
+        return lambda value: None if _is_integer(value) else 'should be an integer'
+    if isinstance(example, numbers.Real):
+        return lambda value: None if _is_number(value) else 'should be a finite number'
+    if isinstance(example, dict):
+        value_check = _check_for(next(iter(example.values()))) if example else (lambda value: None)
+
+        def check_dict(value):
+            if not isinstance(value, dict):
+                return 'should be an object'
+            for key, val in value.items():
+                if not isinstance(key, str) or value_check(val) is not None:
+                    return 'invalid entry {!r}: {!r}'.format(key, val)
+            return None
+        return check_dict
+    if isinstance(example, list):
+        # vectors are checked separately, see TermValidator.validate_batch
+        return None
+    raise ValueError('Unsupported example value {!r}'.format(example))
+
+
+class TermValidator:
+    """
+    Validator for the term objects sent with StarChatClient.add_term.
+    Field checks are built once from an example term (see schemas/add_term.json) and applied to whole batches.
+    """
+
+    def __init__(self, example: dict = None, vector_dim: int = None, required: tuple = ('term',)):
+        """
+        :param example: example term object defining the accepted fields and their types. If None, TERM_EXAMPLE
+                        is used
+        :param vector_dim: expected dimension of the vectors. If None, the vectors of each batch should have
+                           the most common dimension of the batch (see `infer_vector_dim`)
+        :param required: fields that must be present in each term
+        """
+        example = TERM_EXAMPLE if example is None else example
+        self.checks = {field: _check_for(value) for field, value in example.items()}
+        self.vector_fields = [field for field, check in self.checks.items() if check is None]
+        self.vector_dim = vector_dim
+        self.required = required
+
+    @classmethod
+    def from_schema_file(cls, schema_path: str, **kwargs):
+        """
+        Build the validator from a json file in the format of schemas/add_term.json
+        :param schema_path: path to the json file
+        :return: TermValidator object
+        """
+        with open(schema_path, encoding='utf-8') as f:
+            return cls(json.load(f)['terms'][0], **kwargs)
+
+    def _check_vector(self, vector, dim):
+        """
+        Check a vector, given as a list of numbers or as a 1-dimensional numpy array
+        :return: tuple (error message or None, dimension of the vector)
+        """
+        if hasattr(vector, 'dtype'):  # numpy array, checked without iterating in python
+            import numpy as np
+            if vector.ndim != 1:
+                return 'should be a 1-dimensional array', None
+            if vector.dtype.kind not in 'iuf':
+                return 'unsupported dtype {}'.format(vector.dtype), None
+            if vector.dtype.kind == 'f' and not np.isfinite(vector).all():
+                return 'contains NaN or infinite values', None
+            length = vector.shape[0]
+        elif isinstance(vector, list):
+            if not all(map(_is_number, vector)):
+                return 'should contain finite numbers only', None
+            length = len(vector)
+        else:
+            return 'should be a list of numbers or a numpy array', None
+        if dim is not None and length != dim:
+            return 'has dimension {} instead of {}'.format(length, dim), None
+        return None, length
+
+    def validate(self, term, vector_dim: int = None) -> list:
+        """
+        Validate a single term object
+        :param term: term object
+        :param vector_dim: expected dimension of the vectors (overrides the validator's one)
+        :return: list of error messages (empty if the term is valid)
+        """
+        return self._validate(term, vector_dim if vector_dim is not None else self.vector_dim, dict())
+
+    def _validate(self, term, dim, vector_errors: dict) -> list:
+        """
+        Validate a single term object against the expected vector dimension `dim`
+        :param vector_errors: dict() containing field: error_message_or_None pairs for the vectors of the term
+                              already checked by `validate_batch`
+        """
+        if not isinstance(term, dict):
+            return ['term should be a json object']
+        errors = ['missing field `{}`'.format(field) for field in self.required if field not in term]
+        for field, value in term.items():
+            if field not in self.checks:
+                errors.append('unknown field `{}`'.format(field))
+                continue
+            if field in self.vector_fields:
+                if field in vector_errors:
+                    error = vector_errors[field]
+                else:
+                    error, _ = self._check_vector(value, dim)
+            else:
+                error = self.checks[field](value)
+            if error is not None:
+                errors.append('`{}` {}'.format(field, error))
+        return errors
+
+    def infer_vector_dim(self, terms: list):
+        """
+        Get the most common dimension of the vectors in a batch of terms
+        :param terms: list of term objects
+        :return: most common vector dimension, or None if no term has a vector
+        """
+        dims = Counter()
+        for term in terms:
+            if not isinstance(term, dict):
+                continue
+            for field in self.vector_fields:
+                vector = term.get(field)
+                if isinstance(vector, list):
+                    dims[len(vector)] += 1
+                elif hasattr(vector, 'shape') and len(vector.shape) == 1:
+                    dims[vector.shape[0]] += 1
+        return dims.most_common(1)[0][0] if dims else None
+
+    def _check_numpy_vectors(self, terms: list, dim: int) -> dict:
+        """
+        Check at once all the numpy vectors of the batch having the expected dimension and a numeric dtype,
+        stacking them in a matrix (see `valid_vector_rows`)
+        :return: dict() containing (position, field): error_message_or_None pairs for the checked vectors
+        """
+        if dim is None:
+            return dict()
+        results = dict()
+        for field in self.vector_fields:
+            positions = [i for i, term in enumerate(terms)
+                         if isinstance(term, dict) and hasattr(term.get(field), 'dtype') and
+                         term[field].ndim == 1 and term[field].shape[0] == dim and term[field].dtype.kind in 'iuf']
+            if not positions:
+                continue
+            import numpy as np
+            mask = valid_vector_rows(np.stack([terms[i][field] for i in positions]), dim)
+            for i, is_valid in zip(positions, mask):
+                results[(i, field)] = None if is_valid else 'contains NaN or infinite values'
+        return results
+
+    def validate_batch(self, terms: list):
+        """
+        Validate a batch of term objects. If the validator has no vector_dim, the expected dimension is the most
+        common one in the batch. Numpy vectors are checked all at once.
+        :param terms: list of term objects
+        :return: tuple (valid_terms, invalid) where invalid is a list of (position, term, list_of_errors) tuples
+        """
+        dim = self.vector_dim if self.vector_dim is not None else self.infer_vector_dim(terms)
+        numpy_results = self._check_numpy_vectors(terms, dim)
+        valid = []
+        invalid = []
+        for position, term in enumerate(terms):
+            vector_errors = {field: numpy_results[(position, field)] for field in self.vector_fields
+                             if (position, field) in numpy_results}
+            errors = self._validate(term, dim, vector_errors)
+            if errors:
+                invalid.append((position, term, errors))
+            else:
+                valid.append(term)
+        return valid, invalid
+
+
+def valid_vector_rows(matrix, vector_dim: int = None):
+    """
+    Vectorized check of a matrix of term vectors (one vector per row), e.g. before building add_term payloads
+    :param matrix: 2-dimensional numpy array
+    :param vector_dim: expected dimension of the vectors
+    :return: boolean numpy array, True for rows containing valid vectors
+    """
+    import numpy as np
+    if matrix.ndim != 2 or matrix.dtype.kind not in 'iuf' or (vector_dim is not None and
+                                                              matrix.shape[1] != vector_dim):
+        return np.zeros(matrix.shape[0], dtype=bool)
+    if matrix.dtype.kind != 'f':
+        return np.ones(matrix.shape[0], dtype=bool)
+    return np.isfinite(matrix).all(axis=1)
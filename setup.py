@@ -19,5 +19,10 @@ setuptools.setup(
         "Operating System :: OS Independent",
     ],
     python_requires='>=3.6',
-    install_requires=["requests",]
+    install_requires=["requests",],
+    entry_points={
+        "console_scripts": [
+            "py-starchat=py_starchat.cli:main",
+        ],
+    },
 )